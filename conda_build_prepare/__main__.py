@@ -11,13 +11,14 @@ def existingDir(dir_name):
         restore_config_files()
         sys.exit(0)
 
-    dir_name = os.path.join(os.path.abspath(os.path.curdir), dir_name)
+    # abspath already resolves relative paths against the CWD
+    dir_name = os.path.abspath(dir_name)
     if(not os.path.isdir(dir_name)):
         raise argparse.ArgumentTypeError(f"{dir_name} is not a valid directory")
     return dir_name
 
 def newDir(dir_name):
-    dir_name = os.path.join(os.path.abspath(os.path.curdir), dir_name)
+    dir_name = os.path.abspath(dir_name)
     if(os.path.exists(dir_name)):
         raise argparse.ArgumentTypeError(f"{dir_name} already exists")
     return dir_name
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import functools
+import hashlib
 import io
 import jinja2
 import json
@@ -10,6 +12,9 @@ import subprocess
 import sys
 import tempfile
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 # Conda's `pip` doesn't install `ruamel.yaml` because it finds it is already
 # installed but the one from Conda has to be imported with `ruamel_yaml`
 try:
@@ -19,7 +24,48 @@ except ModuleNotFoundError:
 yaml = YAML()
 yaml.allow_duplicate_keys = True
 
-from .prepare import get_local_channels, get_package_condarc
+# A single Jinja2 environment with an on-disk bytecode cache; repeated runs
+# on the same recipe (e.g. batch CI scripts) then skip template compilation.
+# Left without a directory argument, the cache picks a per-user,
+# permission-checked location — a path shared between users would be
+# unwritable for all but the first one and would trust their bytecode
+_jinja_templates = {}
+_jinja_env = jinja2.Environment(
+        loader=jinja2.DictLoader(_jinja_templates),
+        bytecode_cache=jinja2.FileSystemBytecodeCache())
+
+
+# Mostly dummy Jinja2 structures used in Conda recipes; static, so built
+# once at module scope ('environ' is a live view of the environment)
+def _pin_compatible(package_name, min_pin='x.x.x.x.x.x', max_pin='x', lower_bound=None, upper_bound=None):
+    return ''
+def _pin_subpackage(package_name, min_pin='x.x.x.x.x.x', max_pin='x', exact=False):
+    return ''
+_conda_context = {
+        'environ':              os.environ,
+        'os':                   os,
+        'GIT_BUILD_STR':        '',
+        'GIT_DESCRIBE_HASH':    '',
+        'GIT_DESCRIBE_NUMBER':  '',
+        'GIT_DESCRIBE_TAG':     '',
+        'GIT_FULL_HASH':        '',
+        'compiler':             lambda _: '',
+        'cdt':                  lambda _: '',
+        'pin_compatible':       _pin_compatible,
+        'pin_subpackage':       _pin_subpackage,
+        'resolved_packages':    lambda _: [],
+        }
+
+
+def _render_jinja(template_text, context):
+    # get_template (unlike from_string) consults the bytecode cache, so
+    # register the text under a content-derived name first
+    name = hashlib.sha1(template_text.encode()).hexdigest()
+    _jinja_templates[name] = template_text
+    return _jinja_env.get_template(name).render(context)
+
+
+from .prepare import get_local_channels, get_package_condarc, _load_yaml_fast
 from .git_helpers import git_checkout, git_clone, git_describe, \
         git_rewrite_tags, git_add_tag, git_clone_relative_submodules
 
@@ -36,45 +82,123 @@ def find(key, dictionary):
     >>> list(find("key", { "_" : [ { "key" : "value" }, { "key": "value2" } ] }))
     ['value', 'value2']
     """
-    for k, v in dictionary.items():
-        if k == key:
-            yield v
-        elif isinstance(v, dict):
-            for result in find(key, v):
-                yield result
-        elif isinstance(v, list):
-            for d in v:
-                if isinstance(d, dict):
-                    for result in find(key, d):
-                        yield result
+    # Iterative traversal with an explicit queue avoids recursion frames
+    # and generator resumption costs on deeply nested metadata
+    queue = deque([dictionary])
+    while queue:
+        current = queue.popleft()
+        if isinstance(current, dict):
+            for k, v in current.items():
+                if k == key:
+                    yield v
+                else:
+                    queue.append(v)
+        elif isinstance(current, list):
+            queue.extend(current)
+
+
+# The rendered metadata is fully determined by the recipe inputs and the
+# rendering environment, so cache it keyed by a hash of those; each
+# conda-meta entry names one installed package exactly
+# (name-version-build.json), so the listing identifies the environment
+# even across recreations with the same package set
+def _rendered_meta_cache_path(package_dir, env_dir):
+    hasher = hashlib.sha256()
+    # Besides the recipe files, rendering reads the OS-specific package
+    # condarc plus the channel configuration prepare_environment wrote
+    # into the env, so all of them take part in the key
+    input_paths = [
+        os.path.join(package_dir, 'meta.yaml'),
+        os.path.join(package_dir, 'conda_build_config.yaml'),
+        get_package_condarc(package_dir),
+        os.path.join(env_dir, 'condarc'),
+        os.path.join(env_dir, '.condarc'),
+    ]
+    for input_path in input_paths:
+        if input_path is not None and os.path.exists(input_path):
+            hasher.update(os.path.basename(input_path).encode())
+            with open(input_path, 'rb') as input_file:
+                hasher.update(input_file.read())
+    # `conda render` interpolates environment variables; these are the
+    # ones this tool itself feeds into recipes
+    for var in ['TOOLCHAIN_ARCH', 'DATE_STR', 'DATE_NUM']:
+        hasher.update(f'{var}={os.environ.get(var, "")}'.encode())
+    try:
+        packages = sorted(os.listdir(os.path.join(env_dir, 'conda-meta')))
+    except FileNotFoundError:
+        packages = []
+    hasher.update('\0'.join(packages).encode())
+
+    cache_dir = os.path.join(os.path.expanduser('~/.cache'),
+            'conda-build-prepare')
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, hasher.hexdigest() + '.yaml')
+
+
+# At most this many cached renders are kept around
+_max_cached_renders = 32
+
+def _prune_rendered_meta_cache(cache_dir):
+    with os.scandir(cache_dir) as it:
+        entries = [entry for entry in it if entry.name.endswith('.yaml')]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[_max_cached_renders:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
 
 
 def render_metadata(package_dir, env_dir, verbose=False):
     assert os.path.isdir(package_dir)
 
+    cache_path = _rendered_meta_cache_path(package_dir, env_dir)
+    try:
+        with open(cache_path, 'r') as cached_file:
+            meta = _load_yaml_fast(cached_file)
+        print('Using previously rendered package metadata.\n')
+        return meta
+    except FileNotFoundError:
+        pass
+
     print('Rendering package metadata, please wait...\n')
     meta = None
+    # Render within a private croot; removing that directory afterwards
+    # replaces a multi-second `conda build purge-all` invocation
+    tmp_croot = tempfile.mkdtemp(prefix='conda-build-prepare_render_')
     try:
         rendered_path = os.path.join(package_dir, 'rendered_metadata.yaml')
-        _call_conda_cmd_in_env(f"conda render -f {rendered_path} {package_dir}", env_dir)
+        _call_conda_cmd_in_env(['conda', 'render', '--croot', tmp_croot,
+                '-f', rendered_path, package_dir], env_dir)
         with open(rendered_path, 'r') as rendered_file:
-            meta = yaml.load(rendered_file.read())
+            rendered_text = rendered_file.read()
+        meta = _load_yaml_fast(rendered_text)
+        # Written next to the final name and switched in atomically so a
+        # killed run can't leave a truncated cache entry behind
+        tmp_cache_path = cache_path + '.tmp'
+        with open(tmp_cache_path, 'w') as cached_file:
+            cached_file.write(rendered_text)
+        os.replace(tmp_cache_path, cache_path)
+        _prune_rendered_meta_cache(os.path.dirname(cache_path))
     except:
         print('Error during package metadata rendering!')
         raise
     finally:
         # Clean the build data created while rendering the metadata.
-        _call_conda_cmd_in_env(f"conda build purge-all", env_dir)
+        shutil.rmtree(tmp_croot, ignore_errors=True)
         if os.path.exists(rendered_path):
             os.remove(rendered_path)
 
     return meta
 
 
+@functools.lru_cache(maxsize=None)
 def git_cache_path():
     return os.path.join(path(), "conda-bld", "git_cache")
 
 
+# Memoized; the value only depends on the environment set at startup
+@functools.lru_cache(maxsize=None)
 def path():
     return os.environ.get('CONDA_PATH', os.path.expanduser('~/conda'))
 
@@ -106,10 +230,14 @@ def create_env(package_dir):
 
     prefix = run("create", "--name", package, "--strict-channel-priority")
     env_condarc = os.path.join(prefix, 'condarc')
+    # Serialize once; print the same buffer instead of rereading the file
+    condarc_buf = io.StringIO()
+    yaml.dump(data, condarc_buf)
+    condarc_text = condarc_buf.getvalue()
     with open(env_condarc, "w") as f:
-        yaml.dump(data, f)
+        f.write(condarc_text)
 
-    print(open(env_condarc).read())
+    print(condarc_text)
 
 
 def _prepare_single_source(git_repos_dir, src):
@@ -118,34 +246,39 @@ def _prepare_single_source(git_repos_dir, src):
         return None
     else:
         # Clone, checkout the repository and return its local path
-        src_path = git_clone(src['git_url'], git_repos_dir)
+        src_path = git_clone(src['git_url'], git_repos_dir, partial=True)
         if 'git_rev' in src.keys():
             git_checkout(src_path, src['git_rev'])
         git_clone_relative_submodules(src_path, src['git_url'])
         return os.path.abspath(src_path)
 
 def _add_extra_tags_if_exist(package_dir, repo_path):
-    assert os.path.exists(package_dir)
     extra_tags_path = os.path.join(package_dir, 'extra.tags')
 
-    if not os.path.exists(extra_tags_path):
+    # Opening directly saves a stat; most packages have no extra.tags
+    try:
+        extra_tags_file = open(extra_tags_path, 'r')
+    except FileNotFoundError:
         return
     else:
         print()
         print('Adding tags from extra.tags file...')
-        with open(extra_tags_path, 'r') as extra_tags_file:
-            for line in extra_tags_file.readlines():
-                try:
-                    tag, sha = line.replace('\n', '').split()
-                    git_add_tag(repo_path, tag, sha, temp_user=True)
-                except ValueError:
+        with extra_tags_file:
+            # Iterate the file object directly; readlines() would build the
+            # whole list in memory just to throw it away
+            for line in extra_tags_file:
+                parts = line.split()
+                if len(parts) != 2:
                     print('Malformed line in extra.tags:')
-                    print('\t"{}"'.format(line.replace('\n', '')))
+                    print('\t"{}"'.format(line.rstrip('\n')))
                     print()
                     continue
+                tag, sha = parts
+                try:
+                    git_add_tag(repo_path, tag, sha, temp_user=True)
                 except subprocess.CalledProcessError:
                     print('Git had problems adding extra.tags line:')
-                    print('\t"{}"'.format(line.replace('\n', '')))
+                    print('\t"{}"'.format(line.rstrip('\n')))
                     print()
                     continue
         print()
@@ -153,14 +286,18 @@ def _add_extra_tags_if_exist(package_dir, repo_path):
 # A wrapper for subprocess.check_output printing stdout in case of process
 # error. By default it isn't printed and can make debugging much harder.
 def _check_output(command, **kwargs):
+    # An argv list is preferred; a string is split on whitespace, which
+    # breaks paths with spaces, so it's kept only for simple commands
+    if isinstance(command, str):
+        command = command.split()
     try:
-        return subprocess.check_output(command.split(), encoding='utf-8',
+        return subprocess.check_output(command, encoding='utf-8',
                 **kwargs).strip()
     except subprocess.CalledProcessError as e:
         print('!! =======================================================')
         print('!! ERROR: conda-build-prepare subprocess failed!')
         print('!!')
-        print('!! Command called: ' + command)
+        print('!! Command called: ' + ' '.join(command))
         print('!!')
         print('!! STDERR not captured; look above for errors too! STDOUT:')
         print('!!')
@@ -171,22 +308,71 @@ def _check_output(command, **kwargs):
         raise
 
 
-def _call_conda_cmd_in_env(cmd_string, env_path):
+# Where an environment keeps its executables, and what the conda binary
+# there is called ('Scripts' and 'conda.exe' on Windows)
+_env_bin_subdir = 'Scripts' if sys.platform in ['cygwin', 'msys', 'win32'] else 'bin'
+_conda_bin_name = 'conda.exe' if _env_bin_subdir == 'Scripts' else 'conda'
+
+
+# Materialized once per environment; building the activation dict for
+# every subprocess call would copy os.environ each time
+@functools.lru_cache(maxsize=None)
+def _activated_env(env_path):
+    env = dict(os.environ)
+    env['CONDA_PREFIX'] = env_path
+    env['CONDA_DEFAULT_ENV'] = env_path
+    # Tools spawned by conda (e.g. conda-build) are found via PATH
+    env['PATH'] = (os.path.join(env_path, _env_bin_subdir) + os.pathsep
+            + env.get('PATH', ''))
+    return env
+
+
+def _call_conda_cmd_in_env(cmd, env_path):
     assert os.path.isdir(env_path), env_path
 
-    return _check_output(f'conda run -p {env_path} {cmd_string}')
+    # Accept both an argv list and a simple whitespace-separable string
+    if isinstance(cmd, str):
+        cmd = cmd.split()
+    assert cmd[0] == 'conda', cmd
+
+    # Calling the environment's own `conda` binary directly skips the
+    # activation hooks `conda run` executes on each call; fall back to
+    # `conda run` if the environment has no `conda` of its own.
+    conda_bin = os.path.join(env_path, _env_bin_subdir, _conda_bin_name)
+    if os.path.exists(conda_bin):
+        return _check_output([conda_bin] + cmd[1:],
+                env=_activated_env(env_path))
+
+    return _check_output(['conda', 'run', '-p', env_path] + cmd)
 
 _modification_line = '# Modified by the conda-build-prepare\n'
 
+_config_src_re = re.compile(r'==> (.*) <==')
+
+_selector_quote_re = re.compile(r'"([^"\n]*)"(\s*#\s*\[[^\]\n]+\])')
+
+_version_line_re = re.compile(r'(\s+version:).+')
+
+_compiler_re = re.compile(r'''
+        \{\{\s*
+        compiler
+        [\(\'"\s]+      # (' or (" with optional spaces
+        ([a-zA-Z]+)     # lang (c/cxx/...)
+        [\)\'"\s]+      # ') or ") with optional spaces
+        \}\}
+        (.*)            # extra_specifiers (e.g. 4.0 [linux])
+        ''', re.VERBOSE)
+
 def _comment_file(path):
     assert os.path.exists(path), path
 
-    with open(path, 'r') as f:
-        lines = f.readlines()
-    with open(path, 'w') as f:
-        f.write(_modification_line)
-        for line in lines:
-            f.write('#' + line)
+    # Stream line by line into a sibling file and swap it in atomically;
+    # memory use stays flat no matter how large the config file is
+    tmp_path = path + '.conda-build-prepare'
+    with open(path, 'r') as src, open(tmp_path, 'w') as dst:
+        dst.write(_modification_line)
+        dst.writelines('#' + line for line in src)
+    os.replace(tmp_path, path)
 
 _modified_cfg_srcs = os.path.join(tempfile.gettempdir(),
         'conda-build-prepare_srcs.txt')
@@ -203,26 +389,26 @@ def prepare_environment(recipe_dir, env_dir, package_list, env_settings,
 
     print('Preparing the environment, please wait...\n')
 
-    # Convert a list of packages to a string
-    packages = ' '.join(package_list)
-
     # Always install conda-build in the created environment
+    packages = list(package_list)
     if 'conda-build' not in packages:
-        packages += ' conda-build'
+        packages.append('conda-build')
 
     # Create environment
     # (no-default-packages counteracts create_default_packages option)
-    _check_output(f'conda create --yes --no-default-packages -p {env_dir} '
-            + packages)
+    _check_output(['conda', 'create', '--yes', '--no-default-packages',
+            '-p', env_dir] + packages)
 
     # Comment out all config files influencing created environment
     config = _call_conda_cmd_in_env('conda config --show-sources', env_dir)
-    config_sources = re.findall('==> (.*) <==', config)
+    config_sources = _config_src_re.findall(config)
     file_modified = False
-    for config_src in config_sources:
+    # Sources are not only files (e.g. it can be 'envvar')
+    config_files = [src for src in config_sources if os.path.isabs(src)]
+    if config_files:
+        # One open for all sources instead of reopening the file per source
         with open(_modified_cfg_srcs, 'a') as tmp:
-            # Sources are not only files (e.g. it can be 'envvar')
-            if os.path.isabs(config_src):
+            for config_src in config_files:
                 _comment_file(config_src)
                 file_modified = True
                 # Remember files for restoring
@@ -234,25 +420,45 @@ def prepare_environment(recipe_dir, env_dir, package_list, env_settings,
 
     # Apply env_settings (dictionary with keys: 'add'/'prepend', 'append', 'set')
     # to the second most important condarc file: `$ENV/.condarc` (DOTcondarc).
+    # The file is written directly; calling `conda run ... conda config` once
+    # per action costs seconds of conda startup each without changing anything
+    # beyond this YAML file.
+    dot_condarc_path = os.path.join(env_dir, '.condarc')
+    try:
+        with open(dot_condarc_path, 'r') as f:
+            dot_condarc = yaml.load(f) or {}
+    except FileNotFoundError:
+        dot_condarc = {}
     for action in env_settings:
-        # It can be a single command for each action
-        command = f"conda config --env"
         for key in env_settings[action]:
             if isinstance(env_settings[action][key], list):
                 values = env_settings[action][key]
             # If not a list, create a single-element list 'values'
             else:
                 values = [env_settings[action][key]]
-            for value in values:
-                command += f" --{action} {key} {value}"
-        _call_conda_cmd_in_env(command, env_dir)
+            if action == 'set':
+                # `conda config --set` keeps only the last value given
+                dot_condarc[key] = values[-1]
+            elif action in ['add', 'prepend']:
+                # Repeated `conda config --prepend` flags leave the last
+                # value on top, so each value goes in front of the
+                # previous ones
+                key_list = dot_condarc.setdefault(key, [])
+                for value in values:
+                    key_list.insert(0, value)
+            elif action == 'append':
+                dot_condarc.setdefault(key, []).extend(values)
+            else:
+                raise ValueError(f"Unknown env_settings action: '{action}'")
+    with open(dot_condarc_path, 'w') as f:
+        yaml.dump(dot_condarc, f)
 
     # Set package's `condarc` file as the most important one: `$ENV/condarc`.
     # If there's a `channels` key, then the `--channels` args are put on top.
     package_condarc = get_package_condarc(recipe_dir)
     if package_condarc is not None:
         with open(package_condarc, 'r') as f:
-            condarc_yaml = yaml.load(f.read())
+            condarc_yaml = yaml.load(f)
         if 'channels' in condarc_yaml:
             for channel in top_channels:
                 condarc_yaml['channels'].insert(0, channel)
@@ -263,13 +469,15 @@ def prepare_environment(recipe_dir, env_dir, package_list, env_settings,
 def _uncomment_file(path):
     assert os.path.exists(path), path
 
-    with open(path, 'r') as f:
-        lines = f.readlines()
-    if not lines[0] == _modification_line:
-        raise ValueError(f"'{path}' wasn't modified by the conda-build-prepare")
-    with open(path, 'w') as f:
-        for line in lines[1:]:
-            f.write(line.lstrip('#'))
+    tmp_path = path + '.conda-build-prepare'
+    with open(path, 'r') as src:
+        if src.readline() != _modification_line:
+            raise ValueError(f"'{path}' wasn't modified by the conda-build-prepare")
+        # Strip exactly the one '#' added by _comment_file from each line
+        with open(tmp_path, 'w') as dst:
+            dst.writelines(line[1:] if line.startswith('#') else line
+                    for line in src)
+    os.replace(tmp_path, path)
 
 def restore_config_files():
     if not os.path.exists(_modified_cfg_srcs):
@@ -295,80 +503,76 @@ def prepare_recipe(package_dir, git_repos_dir, env_dir):
     assert os.path.exists(env_dir), env_dir
 
     meta_path = os.path.join(package_dir, 'meta.yaml')
-    with(open(meta_path, 'r+')) as meta_file:
-        # Read 'meta.yaml' contents
+    # Read 'meta.yaml' contents
+    with open(meta_path, 'r') as meta_file:
         meta_contents = meta_file.read()
-        original_meta = meta_contents
-
-        # Load yaml with mostly dummy Jinja2 structures used in Conda recipes
-        def _pin_compatible(package_name, min_pin='x.x.x.x.x.x', max_pin='x', lower_bound=None, upper_bound=None):
-            return ''
-        def _pin_subpackage(package_name, min_pin='x.x.x.x.x.x', max_pin='x', exact=False):
-            return ''
-        conda_context = {
-                'environ':              os.environ,
-                'os':                   os,
-                'GIT_BUILD_STR':        '',
-                'GIT_DESCRIBE_HASH':    '',
-                'GIT_DESCRIBE_NUMBER':  '',
-                'GIT_DESCRIBE_TAG':     '',
-                'GIT_FULL_HASH':        '',
-                'compiler':             lambda _: '',
-                'cdt':                  lambda _: '',
-                'pin_compatible':       _pin_compatible,
-                'pin_subpackage':       _pin_subpackage,
-                'resolved_packages':    lambda _: [],
-                }
-        jinja_rendered_meta = jinja2.Template(meta_contents).render(conda_context)
-
-        safe_yaml = YAML(typ='safe')
-        safe_yaml.allow_duplicate_keys = True
-        # Yaml loader doesn't like [OS] after quoted strings (which are OK for Conda)
-        # Quotes are removed before loading as they are irrelevant at this point
-        meta = safe_yaml.load(jinja_rendered_meta.replace('"', ''))
-
-        if len(list(find("git_url", meta))) < 1:
-            print('No git repositories in the package recipe; tag rewriting will be skipped.')
-            print()
-        else:
-            sources = meta['source']
+    original_meta = meta_contents
 
-            # Make sources a one-element list if it's not a list
-            if not isinstance(sources, list):
-                sources = [ sources ]
+    # Recipes without any Jinja2 directives don't need the compile+render pass
+    if '{{' in meta_contents or '{%' in meta_contents:
+        jinja_rendered_meta = _render_jinja(meta_contents, _conda_context)
+    else:
+        jinja_rendered_meta = meta_contents
 
-            if 'git_url' not in sources[0]:
-                print("First source isn't a git repository; tag rewriting will be skipped.")
-                print()
-            else:
-                # Clone sources and make conda use always those
-                print('Cloning git sources...')
-                print()
+    # Yaml loader doesn't like [OS] after quoted strings (which are OK for Conda)
+    # Only quotes followed by such a selector comment are removed; they are
+    # irrelevant at this point and stripping the rest would mangle values
+    meta = _load_yaml_fast(_selector_quote_re.sub(r'\1\2', jinja_rendered_meta))
 
-                os.mkdir(git_repos_dir)
-                first_git_repo_path = None
-
-                for src in sources:
-                    # The recipe can have some mix of git and non-git sources
-                    if 'git_url' in src:
-                        local_git_url = _prepare_single_source(git_repos_dir, src)
-                        meta_contents = meta_contents.replace(
-                                f"git_url: {src['git_url']}", f"git_url: {local_git_url}")
-                        if first_git_repo_path is None:
-                            first_git_repo_path = local_git_url
-
-                # Set version based on modified git repo
-                print('Modifying git tags to set proper package version...')
-
-                git_rewrite_tags(first_git_repo_path)
-                _add_extra_tags_if_exist(package_dir, first_git_repo_path)
-                version = git_describe(first_git_repo_path).replace('-', '_')
-                meta_contents = re.sub(r'(\s+version:).+', r'\1 ' + str(version),
-                        meta_contents)
-
-                # Reset 'meta.yaml' and save metadata without GIT_* vars
-                meta_file.seek(0)
-                meta_file.truncate()
+    if not any(find("git_url", meta)):
+        print('No git repositories in the package recipe; tag rewriting will be skipped.')
+        print()
+    else:
+        sources = meta['source']
+
+        # Make sources a one-element list if it's not a list
+        if not isinstance(sources, list):
+            sources = [ sources ]
+
+        if 'git_url' not in sources[0]:
+            print("First source isn't a git repository; tag rewriting will be skipped.")
+            print()
+        else:
+            # Clone sources and make conda use always those
+            print('Cloning git sources...')
+            print()
+
+            os.mkdir(git_repos_dir)
+
+            # The recipe can have some mix of git and non-git sources
+            git_srcs = [src for src in sources if 'git_url' in src]
+
+            # Cloning is network-bound, so overlap the transfers; results
+            # are collected in the recipe's source order
+            local_git_urls = {}
+            with ThreadPoolExecutor(
+                    max_workers=min(8, len(git_srcs))) as executor:
+                futures = [executor.submit(_prepare_single_source,
+                        git_repos_dir, src) for src in git_srcs]
+                for src, future in zip(git_srcs, futures):
+                    local_git_urls[src['git_url']] = future.result()
+            first_git_repo_path = local_git_urls[git_srcs[0]['git_url']]
+
+            # Point all git_urls at the local clones in a single pass over
+            # meta_contents instead of one full-string replace per source
+            git_url_re = re.compile(r'git_url:\s*('
+                    + '|'.join(re.escape(url) for url in local_git_urls)
+                    + r')')
+            meta_contents = git_url_re.sub(
+                    lambda match: 'git_url: ' + local_git_urls[match.group(1)],
+                    meta_contents)
+
+            # Set version based on modified git repo
+            print('Modifying git tags to set proper package version...')
+
+            git_rewrite_tags(first_git_repo_path)
+            _add_extra_tags_if_exist(package_dir, first_git_repo_path)
+            version = git_describe(first_git_repo_path).replace('-', '_')
+            meta_contents = _version_line_re.sub(r'\1 ' + str(version),
+                    meta_contents)
+
+            # Reset 'meta.yaml' and save metadata without GIT_* vars
+            with open(meta_path, 'w') as meta_file:
                 meta_file.write(meta_contents)
 
     # Render metadata
@@ -394,21 +598,11 @@ def prepare_recipe(package_dir, git_repos_dir, env_dir):
         meta['build']['script_env'] = env_vars_set
 
     # Save rendered recipe as meta.yaml
-    meta_path = os.path.join(package_dir, 'meta.yaml')
-    with open(meta_path, 'r+') as meta_file:
-        meta_lines = meta_file.readlines()
-
+    # (the current contents are still in meta_contents; no need to reread)
+    with open(meta_path, 'w') as meta_file:
         # Restore `{{ compiler('c/cxx') }}` even though their corresponding packages have already
         # been added to the recipe. Their presence has some additional influence on `conda-build`.
-        for lang, extra_specifiers in re.findall(r'''
-                \{\{\s*
-                compiler
-                [\(\'"\s]+      # (' or (" with optional spaces
-                ([a-zA-Z]+)     # lang (c/cxx/...)
-                [\)\'"\s]+      # ') or ") with optional spaces
-                \}\}
-                (.*)            # extra_specifiers (e.g. 4.0 [linux])
-                ''', ''.join(meta_lines), re.VERBOSE):
+        for lang, extra_specifiers in _compiler_re.findall(meta_contents):
             # OS specifier will only work in quoted string if it's after '#' (double '#' is OK)
             extra_specifiers = extra_specifiers.replace('[', '# [')
             # lang has to be surrounded by double quotes; PyYaml dumps single ones wrong for Conda
@@ -418,7 +612,6 @@ def prepare_recipe(package_dir, git_repos_dir, env_dir):
                 meta['requirements']['build'] = []
             meta['requirements']['build'].append(yaml_compiler)
 
-        meta_file.seek(0)
         meta_file.write('# Rendered by conda-build-prepare\n')
         meta_file.write('# Original meta.yaml can be found at the end of this file\n')
         meta_file.write('\n')
@@ -434,9 +627,11 @@ def prepare_recipe(package_dir, git_repos_dir, env_dir):
         meta_file.write('\n')
 
         # Save original meta.yaml contents as a comment at the end
+        # (written line by line to avoid a commented copy of the whole file)
         meta_file.write('# Original meta.yaml:\n')
         meta_file.write('#\n')
-        meta_file.write('# ' + original_meta.replace('\n', '\n# ')[:-2])
+        meta_file.writelines('# ' + line
+                for line in original_meta.splitlines(keepends=True))
 
 def _try_cygpath_on_git_url(src_dict):
     try:
@@ -1,16 +1,42 @@
 #!/usr/bin/env python3
 
+import configparser
+import functools
 import os
 import re
+import shutil
 import subprocess
 import urllib.parse
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
-GITHUB_RE = re.compile("github.com[:/](?P<user>[^/\n]+)(/(?P<repo>[^/.].*?))?(.git|/|$)")
+# Literal dots escaped and no lazy '.*?'; the character classes keep the
+# engine from backtracking across the whole URL on near-misses
+GITHUB_RE = re.compile(
+        r"github\.com[:/](?P<user>[^/\s]+?)(?:/(?P<repo>[^/\s]+?))?(?:\.git|/|$)")
 
+VERSION_RE = re.compile(r"""[0-9]+[_.\-][0-9]+  # required major and minor
+                            ([_.\-][0-9]+)?     # optional micro
+                            ([_.\-][0-9]+)?     # optional extra number
+                            ([._\-]*rc[0-9]+)?  # optional release candidate
+                            """, re.VERBOSE)
+
+CLONE_DIR_RE = re.compile(r'.+/([^/]+)(.git)?')
+
+# The only directions `git remote -v` tags its lines with
+_REMOTE_DIRECTIONS = frozenset({'fetch', 'push'})
+
+# Resolved once so subprocess doesn't walk PATH on every git spawn
+_GIT_EXE = shutil.which('git') or 'git'
+
+# Pure function asked about the same URLs repeatedly (clone directory
+# naming, submodule joining, local channels), so memoized
+@functools.lru_cache(maxsize=512)
 def extract_github_parts(url):
-    if not url:
+    # The substring test rejects non-GitHub URLs without starting the
+    # regex engine at all
+    if not url or 'github.com' not in url:
         return None, None
     m = GITHUB_RE.search(url)
     if not m:
@@ -67,121 +93,165 @@ def extract_github_repo(url):
     return extract_github_parts(url)[1]
 
 
+# Decoded text output without the bytes intermediate of
+# check_output(...).decode('utf-8').strip()
+def _git_out(argv, **kwargs):
+    return subprocess.check_output([_GIT_EXE, *argv[1:]], encoding='utf-8',
+            **kwargs).strip()
+
+
+_repo_info_cache = {}
+
+def _repo_info(git_repo=None):
+    # Answers that cannot change during a single run are asked once per
+    # repository and kept here instead of re-spawning git for each caller
+    key = os.path.abspath(git_repo or os.curdir)
+    info = _repo_info_cache.get(key)
+    if info is None:
+        info = {}
+        git_dir, toplevel = _git_out(['git', 'rev-parse', '--git-dir',
+                '--show-toplevel'], cwd=key).splitlines()
+        info['git_dir'] = git_dir
+        info['toplevel'] = toplevel
+        _repo_info_cache[key] = info
+    return info
+
+
+def _upstream_ref(git_repo=None):
+    # Resolved lazily so callers interested only in e.g. the git dir
+    # don't pay for the extra rev-parse
+    info = _repo_info(git_repo)
+    if 'upstream_ref' not in info:
+        key = os.path.abspath(git_repo or os.curdir)
+        try:
+            info['upstream_ref'] = _git_out(['git', 'rev-parse',
+                    '--symbolic-full-name', '@{u}'], cwd=key)
+        except subprocess.CalledProcessError:
+            # No remote tracking branch configured
+            info['upstream_ref'] = None
+    return info['upstream_ref']
+
+
+_remotes_cache = {}
+
 def remotes(direction):
-    if direction not in ["fetch", "pull"]:
-        return None
-    remotes = subprocess.check_output( ['git', 'remote', '-v']).decode('utf-8').strip().split("\n")
-    return [i for i in remotes if direction in i]
+    if direction not in _REMOTE_DIRECTIONS:
+        raise ValueError(f"Unknown remote direction: '{direction}'")
+    # Nothing in this tool changes remote configuration, so one spawn
+    # per repository and direction is enough for the whole run
+    key = (os.path.abspath(os.curdir), direction)
+    remotes_dict = _remotes_cache.get(key)
+    if remotes_dict is None:
+        lines = _git_out(['git', 'remote', '-v']).splitlines()
+        # `git remote -v` emits two 'name\turl (fetch|push)' lines per
+        # remote; parse the wanted direction once into a dict for O(1)
+        # lookups
+        remotes_dict = {}
+        for line in lines:
+            if not line.endswith(f'({direction})'):
+                continue
+            name, url_direction = line.split('\t')
+            remotes_dict[name] = url_direction.rsplit(' ', 1)[0]
+        _remotes_cache[key] = remotes_dict
+    # A copy, so callers consuming the dict don't empty the cached one
+    return dict(remotes_dict)
 
 
 def upstream(**env):
     """Get 'upstream' URL for the git repository."""
-    remotes = remotes('fetch')
+    fetch_remotes = remotes('fetch')
 
-    # Try the remote tracking value for this branch
-    try:
-        upstream = subprocess.check_output(
-            ['git', 'rev-parse', '--symbolic-full-name', '@{u}'], env=env,
-        ).decode('utf-8').strip()
-        if upstream and '/' in upstream:
-            _, __, remote, remote_branch = upstream.split('/')
-            assert remote in remotes, (remote, remotes)
-            return remotes[remote]
-    except subprocess.CalledProcessError:
-        pass
+    # If there is only one remote, use that; any tracking branch could
+    # only point at it anyway, so the rev-parse below would be wasted
+    if len(fetch_remotes) == 1:
+        return fetch_remotes.popitem()[-1]
 
-    # If there is only one remote, use that
-    if len(remotes) == 1:
-        return remotes.popitem()[-1]
+    # Try the remote tracking value for this branch
+    upstream_ref = _upstream_ref()
+    if upstream_ref and '/' in upstream_ref:
+        _, __, remote, remote_branch = upstream_ref.split('/')
+        assert remote in fetch_remotes, (remote, fetch_remotes)
+        return fetch_remotes[remote]
 
     # Otherwise try using 'origin'
-    if 'origin' in remotes:
-        return remotes['origin']
+    if 'origin' in fetch_remotes:
+        return fetch_remotes['origin']
     # Or 'upstream'
-    if 'upstream' in remotes:
-        return remotes['upstream']
+    if 'upstream' in fetch_remotes:
+        return fetch_remotes['upstream']
 
     return None
 
 
 def metadata(**env):
     metadata = {}
+    # A single rev-parse resolves both values; --abbrev-ref only applies
+    # to the argument following it
     try:
-        metadata['commit'] = subprocess.check_output(
-            ['git', 'rev-parse', 'HEAD'], env=env,
-        ).decode('utf-8').strip()
+        lines = _git_out(
+            ['git', 'rev-parse', 'HEAD', '--abbrev-ref', 'HEAD'],
+            env=env).splitlines()
+        metadata['commit'] = lines[0]
+        metadata['branch'] = lines[1]
     except subprocess.CalledProcessError:
         pass
 
-    try:
-        metadata['branch'] = subprocess.check_output(
-            ['git', 'rev-parse', '--abbrev-ref', 'HEAD'], env=env,
-        ).decode('utf-8').strip()
-    except subprocess.CalledProcessError:
-        pass
+    return metadata
 
 
 def unshallow(**env):
-    if subprocess.check_output(
-                ['git', 'rev-parse', '--is-shallow-repository'],
-                env=env,
-            ).strip() == 'true':
-        subprocess.check_call(['git', 'fetch', '--unshallow'])
+    # A shallow repository is simply one with a $GIT_DIR/shallow file;
+    # checking that from Python avoids an extra git spawn, and the tags
+    # come along in the same fetch instead of a second network round trip
+    if os.path.exists(os.path.join(_repo_info()['git_dir'], 'shallow')):
+        subprocess.check_call([_GIT_EXE, 'fetch', '--unshallow', '--tags'],
+                env=env)
+    else:
+        fetch_tags(**env)
 
 
 def fetch_tags(**env):
-    subprocess.check_call(['git', 'fetch', '--tags'], env=env)
+    subprocess.check_call([_GIT_EXE, 'fetch', '--tags'], env=env)
 
 
-def _call_custom_git_cmd(git_repo, cmd_string, check=True, quiet=False):
-    cmd = cmd_string.split()
+def _call_custom_git_cmd(git_repo, cmd, check=True, quiet=False, capture=True):
+    # An argv list is preferred; a string is split on whitespace, so it
+    # can't carry arguments containing spaces
+    if isinstance(cmd, str):
+        cmd = cmd.split()
+    else:
+        cmd = list(cmd)
     if cmd[0] != 'git':
         cmd.insert(0, 'git')
+    cmd[0] = _GIT_EXE
 
+    # Side-effect-only commands pass capture=False to skip the pipe that
+    # their discarded stdout would otherwise be buffered through
     stdout = subprocess.run(cmd, check=check, cwd=git_repo, encoding='utf-8',
             # None means "don't capture"
             stderr=subprocess.DEVNULL if quiet else None,
-            stdout=subprocess.PIPE).stdout
-    return stdout.strip()
+            stdout=subprocess.PIPE if capture else subprocess.DEVNULL).stdout
+    return stdout.strip() if capture else None
 
 
 def get_latest_describe_tag(git_repo):
-    # Find the `git describe` tag having any version-like part
     try:
-        return _call_custom_git_cmd(git_repo, 'describe --tags --abbrev=0', quiet=True)
+        return _call_custom_git_cmd(git_repo,
+                ['describe', '--tags', '--abbrev=0'], quiet=True)
     except subprocess.CalledProcessError:
         return None
 
 
-def _set_git_config(git_repo, setting, value):
-    _call_custom_git_cmd(git_repo, f'config {setting} {value}')
-
-def _unset_git_config(git_repo, setting):
-    _call_custom_git_cmd(git_repo, f'config --unset {setting}')
-
-class GitUserContext:
-    def __init__(self, git_repo, name, email):
-        self._name = name
-        self._email = email
-        self._repo = git_repo
-
-    def __enter__(self):
-        _set_git_config(self._repo, 'user.name', self._name)
-        _set_git_config(self._repo, 'user.email', self._email)
-
-    def __exit__(self, exc_type, exc_value, traceback):
-        _unset_git_config(self._repo, 'user.name')
-        _unset_git_config(self._repo, 'user.email')
-
-
 def git_add_tag(git_repo, tag, sha, temp_user=True):
-    git_cmd = f'tag --annotate --force -m"{tag}" {tag} {sha}'
-    if temp_user:
-        with GitUserContext(git_repo, 'conda-build-prepare',
-                'conda-build-prepare@github.com'):
-            _call_custom_git_cmd(git_repo, git_cmd)
-    else:
-        _call_custom_git_cmd(git_repo, git_cmd)
+    git_cmd = ['tag', '--annotate', '--force', '-m', tag, tag, sha]
+    if temp_user and not ('GIT_COMMITTER_NAME' in os.environ
+            and 'GIT_COMMITTER_EMAIL' in os.environ):
+        # An inline identity avoids four `git config` spawns per tag and
+        # leaves the repository's on-disk configuration untouched; it's
+        # unnecessary when the environment already provides one (CI)
+        git_cmd = ['-c', 'user.name=conda-build-prepare',
+                '-c', 'user.email=conda-build-prepare@github.com'] + git_cmd
+    _call_custom_git_cmd(git_repo, git_cmd, capture=False)
     print(f"Successfully tagged '{sha}' object as '{tag}'")
 
 
@@ -191,7 +261,36 @@ def git_add_initial_tag(git_repo, temp_user=True):
 
 
 def git_drop_tag(git_repo, tag):
-    _call_custom_git_cmd(git_repo, f'tag -d {tag}')
+    _call_custom_git_cmd(git_repo, ['tag', '-d', tag], capture=False)
+
+
+def git_drop_tags(git_repo, tags):
+    if not tags:
+        return
+    # One `update-ref --stdin` process deletes any number of tags
+    script = ''.join(f'delete refs/tags/{tag}\n' for tag in tags)
+    subprocess.run([_GIT_EXE, 'update-ref', '--stdin'], input=script,
+            cwd=git_repo, encoding='utf-8', check=True)
+
+
+def _list_tags_with_sha(git_repo):
+    # One for-each-ref call maps every tag to the commit it points to;
+    # %(*objectname) is the peeled sha filled in for annotated tags only.
+    # The lines are parsed as they arrive instead of buffering the whole
+    # listing first, which matters on repositories with many tags
+    proc = subprocess.Popen([_GIT_EXE, 'for-each-ref',
+            '--format=%(refname:short)|%(objectname)|%(*objectname)',
+            'refs/tags'], stdout=subprocess.PIPE, cwd=git_repo,
+            encoding='utf-8')
+    tags = {}
+    for line in proc.stdout:
+        # rsplit, because '|' is legal inside a tag name while the two
+        # trailing sha fields can never contain it
+        tag, sha, peeled_sha = line.rstrip('\n').rsplit('|', 2)
+        tags[tag] = peeled_sha or sha
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    return tags
 
 
 def tag_extract_version(tag):
@@ -215,12 +314,11 @@ def tag_extract_version(tag):
     >>> tag_extract_version('7_8_rc12-lessrandom')
     'v7_8_rc12'
     """
-    version_spec = r"""[0-9]+[_.\-][0-9]+  # required major and minor
-                       ([_.\-][0-9]+)?     # optional micro
-                       ([_.\-][0-9]+)?     # optional extra number
-                       ([._\-]*rc[0-9]+)?  # optional release candidate"""
-
-    version_search = re.search(version_spec, tag, re.VERBOSE)
+    # A version needs digits; rejecting digitless tags with a cheap scan
+    # skips the regex for most non-version tags met while rewriting
+    if not any(c.isdigit() for c in tag):
+        return None
+    version_search = VERSION_RE.search(tag)
     if version_search is None:
         return None
     else:
@@ -231,42 +329,78 @@ def tag_extract_version(tag):
 def git_rewrite_tags(git_repo):
     print(f'\nRewriting tags in "{os.path.abspath(git_repo)}"...\n')
 
-    while True:
-        tag = get_latest_describe_tag(git_repo)
-        if tag is None:
-            # Add '0.0' tag on initial commit and skip rewriting.
-            git_add_initial_tag(git_repo)
-            break
-        tag_version = tag_extract_version(tag)
-        if tag_version is None:
-            git_drop_tag(git_repo, tag)
-        else:
-            if tag_version != tag:
-                # Add tag again but with pure version-like name
-                commit = _call_custom_git_cmd(git_repo, f'rev-list -n 1 {tag}')
-                git_drop_tag(git_repo, tag)
-                git_add_tag(git_repo, tag_version, commit)
-            # Finish rewriting after the first successfully rewritten tag
+    tag_shas = _list_tags_with_sha(git_repo)
+
+    # Group tags by the commit they point to; walking `rev-list HEAD`
+    # then visits them nearest-first, the order repeated `git describe`
+    # calls would have produced, but with one extra git process no
+    # matter how many tags end up dropped
+    commit_tags = {}
+    for tag, sha in tag_shas.items():
+        commit_tags.setdefault(sha, []).append(tag)
+
+    # Tags to drop are accumulated and deleted in one batch at the end;
+    # deleting them one by one spawned a git process per tag
+    dropped_tags = []
+    version_tag_found = False
+    proc = subprocess.Popen([_GIT_EXE, 'rev-list', 'HEAD'],
+            stdout=subprocess.PIPE, cwd=git_repo, encoding='utf-8')
+    for line in proc.stdout:
+        for tag in sorted(commit_tags.get(line.strip(), ())):
+            tag_version = tag_extract_version(tag)
+            if tag_version is None:
+                dropped_tags.append(tag)
+            else:
+                if tag_version != tag:
+                    # Add tag again but with pure version-like name
+                    dropped_tags.append(tag)
+                    git_drop_tags(git_repo, dropped_tags)
+                    dropped_tags = []
+                    git_add_tag(git_repo, tag_version, tag_shas[tag])
+                # Finish rewriting after the first version-like tag
+                version_tag_found = True
+                break
+        if version_tag_found:
             break
+    proc.stdout.close()
+    proc.wait()
+
+    git_drop_tags(git_repo, dropped_tags)
+    if not version_tag_found:
+        # Add '0.0' tag on initial commit and skip rewriting.
+        git_add_initial_tag(git_repo)
 
 
 def git_describe(git_repo):
     return _call_custom_git_cmd(git_repo, f'describe --long --tags')
 
 
-def git_clone(url, parent_dir, dir_name=None):
+def git_clone(url, parent_dir, dir_name=None, partial=False):
     assert os.path.exists(parent_dir)
 
     if dir_name is None:
         dir_name = extract_github_repo(url)
         # If not a GitHub URL, just get the last part (excluding .git)
         if dir_name is None:
-            dir_name = re.search(r'.+/([^/]+)(.git)?', url).groups()[0]
+            dir_name = CLONE_DIR_RE.search(url).groups()[0]
 
     repo_path = os.path.join(parent_dir, dir_name)
 
     assert not os.path.exists(repo_path)
-    _call_custom_git_cmd(None, f'clone {url} {repo_path}')
+    if partial:
+        # A blobless clone transfers far less data but keeps the whole
+        # commit and tag history needed for describe-based versioning
+        # (a shallow clone wouldn't); not all servers support it, though
+        try:
+            _call_custom_git_cmd(None,
+                    ['clone', '--filter=blob:none', url, repo_path],
+                    capture=False)
+            return repo_path
+        except subprocess.CalledProcessError:
+            print(f"Partial clone of '{url}' failed; retrying a full clone...")
+            if os.path.exists(repo_path):
+                shutil.rmtree(repo_path)
+    _call_custom_git_cmd(None, ['clone', url, repo_path], capture=False)
 
     return repo_path
 
@@ -274,23 +408,39 @@ def git_clone(url, parent_dir, dir_name=None):
 def git_clone_relative_submodules(git_repo, git_url):
     gitmodules_path = os.path.join(git_repo, '.gitmodules')
 
-    if os.path.exists(gitmodules_path):
-        with open(gitmodules_path, 'r') as f:
-            gitmodules = f.read()
+    # .gitmodules is INI-like; configparser copes with the spacing and
+    # quoting variants the old regex scan missed (and read() simply
+    # parses nothing for a missing file). No interpolation — '%' is
+    # legal in URLs — and not strict, so duplicate sections don't abort
+    gitmodules = configparser.ConfigParser(interpolation=None, strict=False)
+    if gitmodules.read(gitmodules_path):
         # The URLs are stripped from starting '../' for urljoin to work
         # properly; oherwise two parts of the git_url are substituted
-        rel_modules = re.findall('url = \.\./(\S+)', gitmodules)
-        for rel_module in rel_modules:
+        rel_modules = [section['url'][len('../'):]
+                for section in gitmodules.values()
+                if section.get('url', '').startswith('../')]
+        if not rel_modules:
+            return
+        repo_parent = os.path.dirname(git_repo)
+
+        def _clone_submodule(rel_module):
             module_url = urllib.parse.urljoin(git_url, rel_module)
-            repo_parent = os.path.dirname(git_repo)
 
             # rel_module is passed to make sure cloning destination
             # directory will have this exact name (e.g. .git suffix)
-            git_clone(module_url, repo_parent, rel_module)
+            # (submodules aren't used for versioning, so a partial
+            # clone's reduced transfer is safe here too)
+            git_clone(module_url, repo_parent, rel_module, partial=True)
+
+        # Clones are network-bound and independent, so run them concurrently
+        with ThreadPoolExecutor(
+                max_workers=min(8, len(rel_modules))) as executor:
+            # list() propagates any clone exception
+            list(executor.map(_clone_submodule, rel_modules))
 
 
 def git_checkout(git_repo, revision):
-    _call_custom_git_cmd(git_repo, f'checkout {revision}')
+    _call_custom_git_cmd(git_repo, ['checkout', revision], capture=False)
 
 
 def git_get_head_time(git_repo):
@@ -298,6 +448,8 @@ def git_get_head_time(git_repo):
     return datetime.fromtimestamp(int(timestamp_str), timezone.utc)
 
 
+# The answer for a given path cannot change during a run
+@functools.lru_cache(maxsize=None)
 def is_inside_git_repo(path):
     git_cmd = 'git rev-parse --is-inside-work-tree'
     git_stdout = _call_custom_git_cmd(path, git_cmd, check=False, quiet=True)
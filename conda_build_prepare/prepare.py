@@ -1,28 +1,76 @@
 #!/usr/bin/env python3
 
+import functools
 import json
 import os
 import re
 import shutil
 import subprocess
 import sys
+import time
 
-from collections import OrderedDict
-from datetime import datetime, timezone
-# Conda's `pip` doesn't install `ruamel.yaml` because it finds it is already
-# installed but the one from Conda has to be imported with `ruamel_yaml`
-try:
-    from ruamel.yaml import YAML
-except ModuleNotFoundError:
-    from ruamel_yaml import YAML
-
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from .git_helpers import remotes, extract_github_user, _call_custom_git_cmd, \
         git_get_head_time, is_inside_git_repo
 from .travis import get_travis_slug
 
-
+def _ruamel_yaml_class():
+    # Imported on demand so entry points that never touch YAML don't pay
+    # for ruamel's registry setup.
+    # Conda's `pip` doesn't install `ruamel.yaml` because it finds it is
+    # already installed but the one from Conda has to be imported with
+    # `ruamel_yaml`
+    try:
+        from ruamel.yaml import YAML
+    except ModuleNotFoundError:
+        from ruamel_yaml import YAML
+    return YAML
+
+
+# Building the YAML representer/constructor registries isn't free, so
+# one shared instance serves every dump in this module
+_yaml = None
+
+def _get_yaml():
+    global _yaml
+    if _yaml is None:
+        _yaml = _ruamel_yaml_class()()
+    return _yaml
+
+
+# Only for loads where comments don't have to be preserved. The non-pure
+# safe loader uses ruamel's C scanner when available while keeping the
+# first-wins handling of duplicate keys that selector-duplicated recipe
+# entries rely on (PyYAML's C loader would keep the last one instead)
+_safe_yaml = None
+
+def _load_yaml_fast(stream):
+    global _safe_yaml
+    if _safe_yaml is None:
+        _safe_yaml = _ruamel_yaml_class()(typ='safe', pure=False)
+        _safe_yaml.allow_duplicate_keys = True
+    return _safe_yaml.load(stream)
+
+# Strips everything but digits when deriving DATE_NUM from DATE_STR
+_non_digit_re = re.compile(r'[^0-9]')
+
+# The platform can't change at runtime, so classify it once
+if sys.platform.startswith('linux'):
+    _CUR_OS = 'linux'
+elif sys.platform == 'darwin':
+    _CUR_OS = 'macos'
+elif sys.platform in ['cygwin', 'msys', 'win32']:
+    _CUR_OS = 'windows'
+else:
+    _CUR_OS = None
+
+
+# Stable for the process lifetime, so memoized
+@functools.lru_cache(maxsize=None)
 def get_local_channels():
-    local_channels = OrderedDict()
+    # A plain dict keeps insertion order (3.7+) while deduplicating
+    local_channels = {}
 
     travis_slug = get_travis_slug()
     if travis_slug:
@@ -40,22 +88,23 @@ def get_local_channels():
 
 # condarc_$OS has precedence, if exists and '$OS' matches the current OS
 # (it can be condarc_linux, condarc_macos or condarc_windows)
+@functools.lru_cache(maxsize=None)
 def get_package_condarc(recipe_dir):
-    if sys.platform.startswith('linux'):
-        cur_os = 'linux'
-    elif sys.platform == 'darwin':
-        cur_os = 'macos'
-    elif sys.platform in ['cygwin', 'msys', 'win32']:
-        cur_os = 'windows'
-    else:
+    if _CUR_OS is None:
+        return None
+
+    # One directory scan answers both existence checks
+    try:
+        with os.scandir(recipe_dir) as entries:
+            names = {entry.name for entry in entries}
+    except FileNotFoundError:
         return None
 
     condarc = os.path.join(recipe_dir, 'condarc')
-    condarc_os = condarc + '_' + cur_os
 
-    if os.path.exists(condarc_os):
-        return condarc_os
-    elif os.path.exists(condarc):
+    if 'condarc_' + _CUR_OS in names:
+        return condarc + '_' + _CUR_OS
+    elif 'condarc' in names:
         return condarc
     else:
         return None
@@ -70,82 +119,130 @@ def write_metadata(new_recipe_dir, original_recipe_dir):
         }
     }
 
-    def _try_to_get_git_output(cmd_string):
+    # One bound method instead of repeated os.environ attribute and
+    # key traversals across the CI blocks below
+    env_get = os.environ.get
+
+    def _try_to_get_git_output(cmd):
         try:
-            return _call_custom_git_cmd(original_recipe_dir, cmd_string,
+            return _call_custom_git_cmd(original_recipe_dir, cmd,
                     quiet=True)
         except subprocess.CalledProcessError:
             return 'GIT_ERROR'
 
+    on_travis = env_get('TRAVIS', 'false') == 'true'
+    on_github_actions = env_get('GITHUB_ACTIONS', 'false') == 'true'
+
+    if on_travis or on_github_actions:
+        # CI environments below override these three fields anyway, so
+        # don't spawn git to compute throwaway values
+        repo = branch = commit = None
+        describe = _try_to_get_git_output(['describe', '--long'])
+    else:
+        # The commit sha and branch name resolve (or fail) together, so
+        # one rev-parse answers both; the URL and describe can fail
+        # independently (no 'origin' remote, no tags) and keep their own
+        # GIT_ERROR fallback. All three queries are read-only and
+        # independent, so their spawn latencies are overlapped
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            head_future = executor.submit(_try_to_get_git_output,
+                    ['rev-parse', 'HEAD', '--abbrev-ref', 'HEAD'])
+            repo_future = executor.submit(_try_to_get_git_output,
+                    ['remote', 'get-url', 'origin'])
+            describe_future = executor.submit(_try_to_get_git_output,
+                    ['describe', '--long'])
+        head_output = head_future.result()
+        if head_output == 'GIT_ERROR':
+            commit = branch = 'GIT_ERROR'
+        else:
+            commit, branch = head_output.splitlines()
+        repo = repo_future.result()
+        describe = describe_future.result()
+
     # Get details of the repository containing the recipe
     metadata['extra']['recipe_source'] = {
-        'repo':     _try_to_get_git_output('remote get-url origin'),
-        'branch':   _try_to_get_git_output('rev-parse --abbrev-ref HEAD'),
-        'commit':   _try_to_get_git_output('rev-parse HEAD'),
-        'describe': _try_to_get_git_output('describe --long'),
-        'date':     datetime.utcnow().strftime('%Y%m%d_%H%M%S'),
+        'repo':     repo,
+        'branch':   branch,
+        'commit':   commit,
+        'describe': describe,
+        # DATE_STR is set by _set_date_env_vars before this runs, so the
+        # metadata matches the date the recipes themselves see; utcnow is
+        # only a fallback for standalone calls
+        'date':     env_get('DATE_STR')
+                or datetime.utcnow().strftime('%Y%m%d_%H%M%S'),
     }
 
     # Fill in metadata from travis environment
-    if os.environ.get('TRAVIS', 'false') == 'true':
+    if on_travis:
         metadata['extra']['build_type'] = 'travis'
         metadata['extra']['travis'] = {
-            'job_id': int(os.environ.get('TRAVIS_JOB_ID', repr(-1))),
-            'job_num': os.environ.get('TRAVIS_JOB_NUMBER', repr(-1)),
-            'event': os.environ.get('TRAVIS_EVENT_TYPE'),
+            'job_id': int(env_get('TRAVIS_JOB_ID', repr(-1))),
+            'job_num': env_get('TRAVIS_JOB_NUMBER', repr(-1)),
+            'event': env_get('TRAVIS_EVENT_TYPE'),
         }
         # Override details from git with data from travis
         metadata['extra']['recipe_source'] = {
             'repo': 'https://github.com/' + get_travis_slug(),
-            'branch': os.environ.get('TRAVIS_BRANCH', '?'),
-            'commit': os.environ.get('TRAVIS_COMMIT', '?'),
+            'branch': env_get('TRAVIS_BRANCH', '?'),
+            'commit': env_get('TRAVIS_COMMIT', '?'),
             # Leave those two as they were before
             'describe': metadata['extra']['recipe_source']['describe'],
             'date': metadata['extra']['recipe_source']['date'],
         }
 
     # Fill in metadata from github_actions environment
-    if os.environ.get('GITHUB_ACTIONS', 'false') == 'true':
+    if on_github_actions:
         metadata['extra']['build_type'] = 'github_actions'
         metadata['extra']['github_actions'] = {
-            'action_id': os.environ.get('GITHUB_ACTION'),
-            'run_id': os.environ.get('GITHUB_RUN_ID'),
-            'run_num': os.environ.get('GITHUB_RUN_NUMBER'),
-            'event': os.environ.get('GITHUB_EVENT_NAME'),
+            'action_id': env_get('GITHUB_ACTION'),
+            'run_id': env_get('GITHUB_RUN_ID'),
+            'run_num': env_get('GITHUB_RUN_NUMBER'),
+            'event': env_get('GITHUB_EVENT_NAME'),
         }
         # Override details from git with data from github_actions
         metadata['extra']['recipe_source'] = {
-            'repo': 'https://github.com/' + os.environ.get('GITHUB_REPOSITORY'),
-            'branch': os.environ.get('GITHUB_REF', '?'),
-            'commit': os.environ.get('GITHUB_SHA'),
+            'repo': 'https://github.com/' + env_get('GITHUB_REPOSITORY'),
+            'branch': env_get('GITHUB_REF', '?'),
+            'commit': env_get('GITHUB_SHA'),
             # Leave those two as they were before
             'describe': metadata['extra']['recipe_source']['describe'],
             'date': metadata['extra']['recipe_source']['date'],
         }
 
 
-    toolchain_arch = os.environ.get('TOOLCHAIN_ARCH')
+    toolchain_arch = env_get('TOOLCHAIN_ARCH')
     if toolchain_arch is not None:
         metadata['extra']['toolchain_arch'] = toolchain_arch
 
     package_condarc = get_package_condarc(new_recipe_dir)
     if package_condarc is not None:
         with open(package_condarc, 'r') as condarc_file:
-            condarc = YAML().load(condarc_file)
+            # No comments to preserve; the values are only re-emitted as
+            # part of the metadata dump below
+            condarc = _load_yaml_fast(condarc_file)
         metadata['extra']['condarc'] = condarc
 
-    with open(metadata_file, "w") as meta:
-        YAML().dump(metadata, meta)
+    # A binary stream lets the dumper encode once instead of going
+    # through the io text layer's second pass
+    with open(metadata_file, "wb") as meta:
+        _get_yaml().dump(metadata, meta)
+
+
+def _iter_mtimes(directory):
+    # DirEntry.stat() reuses data fetched during the directory scan, so
+    # this halves the syscalls of the old walk + getmtime-per-file pass
+    # (symlinked directories are not descended into, like with os.walk)
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_mtimes(entry.path)
+            elif entry.is_file():
+                yield entry.stat().st_mtime
 
 
 def _get_latest_mtime_in_dir(directory):
-    all_dir_mtimes = []
-    for _dir,_,files in os.walk(directory):
-        for f in files:
-            file_mtime = os.path.getmtime(os.path.join(_dir, f))
-            all_dir_mtimes.append(file_mtime)
-    latest_timestamp = max(all_dir_mtimes)
-    return datetime.fromtimestamp(latest_timestamp, timezone.utc)
+    # A raw timestamp; callers format it with time.gmtime directly
+    return max(_iter_mtimes(directory))
 
 
 def _set_date_env_vars(recipe_dir):
@@ -155,14 +252,17 @@ def _set_date_env_vars(recipe_dir):
 
     if 'DATE_STR' not in os.environ:
         if is_inside_git_repo(recipe_dir):
-            datetime = git_get_head_time(recipe_dir)
+            date_str = git_get_head_time(recipe_dir).strftime(
+                    '%Y%m%d_%H%M%S')
         else:
-            datetime = _get_latest_mtime_in_dir(recipe_dir)
-        date_str = datetime.strftime('%Y%m%d_%H%M%S')
+            # Formatting the raw timestamp skips an intermediate
+            # datetime object (the result is UTC either way)
+            date_str = time.strftime('%Y%m%d_%H%M%S',
+                    time.gmtime(_get_latest_mtime_in_dir(recipe_dir)))
         _set_env_var('DATE_STR', date_str)
 
     # Make sure `DATE_NUM` is always a digit-only version of `DATE_STR`
-    date_num = re.sub(r"[^0-9]", "", os.environ['DATE_STR'])
+    date_num = _non_digit_re.sub('', os.environ['DATE_STR'])
     if 'DATE_NUM' not in os.environ or os.environ['DATE_NUM'] != date_num:
         _set_env_var('DATE_NUM', date_num)
         print()
@@ -184,7 +284,7 @@ def prepare_directory(recipe_dir, dest_dir):
         print('\nPrescript file found! Executing...\n')
         subprocess.check_call(['bash', prescript_path], env=os.environ, cwd=dest_dir,
                 # shell=True only on Windows
-                shell=sys.platform in ['cygwin', 'msys', 'win32'])
+                shell=_CUR_OS == 'windows')
         print('\nFinished executing prescript.\n')
 
     write_metadata(dest_dir, recipe_dir)
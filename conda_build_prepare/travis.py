@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
+import functools
 import os
 
+# The Travis environment doesn't change mid-run, so resolve it once
+@functools.lru_cache(maxsize=1)
 def get_travis_slug():
     travis_repo_slug = os.environ.get('TRAVIS_REPO_SLUG')
     if travis_repo_slug:
         return travis_repo_slug
     travis_pull_request_slug = os.environ.get('TRAVIS_PULL_REQUEST_SLUG')
     if travis_pull_request_slug:
-        return travis_repo_slug
+        return travis_pull_request_slug